@@ -1,9 +1,14 @@
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, wraps
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from textwrap import dedent
 from zipfile import ZipFile
+import hashlib
+import json
 import os
 import shlex
+import subprocess
 import tarfile
 
 import nox
@@ -22,14 +27,29 @@ REQUIREMENTS = dict(
     docs=DOCS / "requirements.txt",
     tests=ROOT / "test-requirements.txt",
 )
-REQUIREMENTS_IN = [  # this is actually ordered, as files depend on each other
-    (
-        ROOT / "pyproject.toml"
-        if path.absolute() == REQUIREMENTS["main"].absolute()
-        else path.parent / f"{path.stem}.in"
-    )
-    for path in REQUIREMENTS.values()
-]
+
+
+@cache
+def _requirements_in():
+    """
+    The input files which requirements are compiled from.
+
+    This is actually ordered, as files depend on each other, and is lazy so
+    that simply loading the noxfile doesn't pay for resolving the paths.
+    """
+    return [
+        (
+            ROOT / "pyproject.toml"
+            if path == REQUIREMENTS["main"]
+            else path.parent / f"{path.stem}.in"
+        )
+        for path in REQUIREMENTS.values()
+    ]
+
+
+CACHE = ROOT / ".cache"
+WHEELHOUSE = CACHE / "wheels"
+os.environ.setdefault("PIP_CACHE_DIR", str(CACHE / "pip"))
 
 
 # aiohttp / aiodocker don't support 3.12
@@ -37,6 +57,7 @@ SUPPORTED = ["pypy3.10", "3.11"]
 LATEST = SUPPORTED[-1]
 
 nox.options.sessions = []
+nox.options.reuse_existing_virtualenvs = True
 
 
 def session(default=True, python=LATEST, **kwargs):  # noqa: D103
@@ -48,12 +69,60 @@ def session(default=True, python=LATEST, **kwargs):  # noqa: D103
     return _session
 
 
+def _install(session, *args):
+    """
+    Install into the session's virtualenv, preferring locally cached wheels.
+    """
+    session.install("--find-links", str(WHEELHOUSE), "--prefer-binary", *args)
+
+
+def _install_if_changed(session, *requirements):
+    """
+    Install requirements files, skipping pip for them if they're unchanged.
+
+    Since virtualenvs are reused by default, an unchanged requirements file
+    means the virtualenv already contains the pinned dependencies. Bowtie
+    itself is always reinstalled though, since the working tree changes
+    without the requirements files doing so.
+    """
+    stamp = Path(session.virtualenv.location) / ".requirements.sha256"
+    digest = hashlib.sha256(
+        b"".join(path.read_bytes() for path in requirements),
+    ).hexdigest()
+    if not stamp.exists() or stamp.read_text() != digest:
+        _install(
+            session,
+            *(arg for path in requirements for arg in ("-r", str(path))),
+        )
+        stamp.write_text(digest)
+    _install(session, ROOT)
+
+
+def _slipcover_summary(github, results):
+    """
+    Append a markdown table of slipcover's JSON results to a GitHub summary.
+    """
+    covered = missing = 0
+    with github.open("a") as summary:
+        summary.write("### Coverage\n\n")
+        summary.write("| File | Coverage |\n")
+        summary.write("| :--- | ---: |\n")
+        for file, each in sorted(results["files"].items()):
+            counts = each["summary"]
+            covered += counts["covered_lines"]
+            missing += counts["missing_lines"]
+            summary.write(f"| {file} | {counts['percent_covered']:.1f}% |\n")
+        lines = covered + missing
+        total = 100 * covered / lines if lines else 100
+        summary.write(f"| **Total** | **{total:.1f}%** |\n")
+
+
 @session(python=SUPPORTED)
 def tests(session):
     """
     Run Bowtie's test suite.
     """
-    session.install("-r", REQUIREMENTS["tests"])
+    _install_if_changed(session, REQUIREMENTS["tests"])
 
     if session.posargs and session.posargs[0] == "coverage":
         if len(session.posargs) > 1 and session.posargs[1] == "github":
@@ -61,22 +130,61 @@ def tests(session):
         else:
             github = None
 
-        session.install("coverage[toml]")
-        session.run("coverage", "run", "-m", "pytest", TESTS)
-        if github is None:
-            session.run("coverage", "report")
-        else:
-            with github.open("a") as summary:
-                summary.write("### Coverage\n\n")
-                summary.flush()  # without a flush, output seems out of order.
-                session.run(
-                    "coverage",
-                    "report",
-                    "--format=markdown",
-                    stdout=summary,
-                )
+        if str(session.python).startswith("pypy"):
+            # coverage.py's tracer is drastically slower under PyPy, whereas
+            # slipcover's bytecode instrumentation has near-zero overhead.
+            _install(session, "slipcover")
+            argv = ["python", "-m", "slipcover", "--branch"]
+            if github is not None:
+                out = Path(session.create_tmp()) / "coverage.json"
+                argv += ["--json", "--out", out]
+            session.run(*argv, "-m", "pytest", "--benchmark-disable", TESTS)
+            if github is not None:
+                _slipcover_summary(github, json.loads(out.read_text()))
+            return
+
+        # pytest-cov measures in-process, which is considerably faster than
+        # spawning a separate coverage process around the whole test run.
+        _install(session, "pytest-cov")
+        report = "term" if github is None else ""
+        session.run(
+            "pytest",
+            "-n",
+            "auto",
+            "--dist=loadfile",
+            "--benchmark-disable",
+            f"--cov={BOWTIE}",
+            f"--cov-report={report}",
+            TESTS,
+        )
+        if github is not None:
+            session.run(
+                "python",
+                "-c",
+                dedent(
+                    """
+                    import os
+
+                    import coverage
+
+                    cov = coverage.Coverage()
+                    cov.load()
+                    with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as file:
+                        file.write("### Coverage\\n\\n")
+                        cov.report(output_format="markdown", file=file)
+                    """,
+                ),
+            )
     else:
-        session.run("pytest", *session.posargs, TESTS)
+        session.run(
+            "pytest",
+            "-n",
+            "auto",
+            "--dist=loadfile",
+            "--benchmark-disable",
+            *session.posargs,
+            TESTS,
+        )
 
 
 @session(python=SUPPORTED)
@@ -84,51 +192,66 @@ def audit(session):
     """
     Audit Python dependencies for vulnerabilities.
     """
-    session.install("pip-audit", "-r", REQUIREMENTS["main"])
+    _install(session, "pip-audit", "-r", REQUIREMENTS["main"])
     # This "vulnerability" is incorrect. See aio-libs/aiohttp#6772.
     AIOHTTP_WRONG = "PYSEC-2022-43059"
     session.run("python", "-m", "pip_audit", "--ignore-vuln", AIOHTTP_WRONG)
 
 
+def _schemas():
+    """
+    Enumerate the schemas Bowtie ships, relative to the schemas directory.
+    """
+    for root, _, files in os.walk(SCHEMAS):
+        relative = os.path.relpath(root, SCHEMAS)
+        for file in files:
+            if file.endswith(".json"):
+                yield file if relative == "." else f"{relative}/{file}"
+
+
 @session(tags=["build"])
 def build(session):
     """
     Build Bowtie (via a PEP517 builder), and check the built artifact is valid.
     """
-    session.install("build", "twine")
-    with TemporaryDirectory() as tmpdir:
+    _install(session, "build", "twine")
+    with TemporaryDirectory() as tmpdir_str:
+        tmpdir = Path(tmpdir_str)
         session.run("python", "-m", "build", ROOT, "--outdir", tmpdir)
-        session.run("twine", "check", "--strict", tmpdir + "/*")
 
-        schemas = frozenset(SCHEMAS.rglob("*.json"))
-        assert schemas, "Didn't find any schemas!"
+        (tarpath,) = tmpdir.glob("*.tar.gz")
+        (wheelpath,) = tmpdir.glob("*.whl")
+        session.run("twine", "check", "--strict", tarpath, wheelpath)
 
-        tmpdir = Path(tmpdir)
+        # Comparing paths relative to SCHEMAS as plain strings keeps the
+        # membership checks below free of per-member pathlib traffic.
+        expected = frozenset(_schemas())
+        assert expected, "Didn't find any schemas!"
 
-        (tarpath,) = tmpdir.glob("*.tar.gz")
         with tarfile.open(tarpath) as tar:
-            found = {
-                SCHEMAS.joinpath(member.name.split("/", 3)[3]).absolute()
-                for member in tar
-                if "bowtie/schemas" in member.name
-            }
-            if not schemas <= found:
-                session.error(
-                    "Tar distribution schemas are missing. "
-                    f"Expected {schemas} but found {found}.",
-                )
-
-        (wheelpath,) = tmpdir.glob("*.whl")
-        wheel = ZipFile(wheelpath)
+            names = tar.getnames()
         found = {
-            SCHEMAS.joinpath(name.removeprefix("bowtie/schemas/")).absolute()
-            for name in wheel.namelist()
-            if name.startswith("bowtie/schemas")
+            name.split("bowtie/schemas/", 1)[1]
+            for name in names
+            if "bowtie/schemas/" in name
         }
-        if not schemas <= found:
+        missing = expected - found
+        if missing:
+            session.error(
+                f"Tar distribution schemas are missing: {missing}.",
+            )
+
+        with ZipFile(wheelpath) as wheel:
+            names = wheel.namelist()
+        found = frozenset(
+            name.removeprefix("bowtie/schemas/")
+            for name in names
+            if name.startswith("bowtie/schemas/")
+        )
+        missing = expected - found
+        if missing:
             session.error(
-                "Wheel distribution schemas are missing. "
-                f"Expected {schemas} but found {found}.",
+                f"Wheel distribution schemas are missing: {missing}.",
             )
 
 
@@ -137,25 +260,47 @@ def app(session):
     """
     Build a PyApp which will run Bowtie.
     """
-    session.install("hatch")
+    _install(session, "hatch")
     session.run("hatch", "build", "-t", "app", *session.posargs)
 
 
 @session(tags=["style"])
+def lint(session):
+    """
+    Run all of Bowtie's style and typing checks out of one shared venv.
+
+    One resolve and install covers what the style, typing and docs(style)
+    sessions would otherwise each pay for separately.
+    """
+    _install(
+        session,
+        "ruff",
+        "pyright",
+        "doc8",
+        "pygments",
+        "pygments-github-lexers",
+        f"{ROOT}[strategies]",
+    )
+    session.run("ruff", "check", BOWTIE, TESTS, __file__)
+    session.run("pyright", BOWTIE)
+    session.run("python", "-m", "doc8", "--config", PYPROJECT, DOCS)
+
+
+@session(default=False, tags=["style"])
 def style(session):
     """
     Lint for style on Bowtie's Python codebase.
     """
-    session.install("ruff")
+    _install(session, "ruff")
     session.run("ruff", "check", BOWTIE, TESTS, __file__)
 
 
-@session()
+@session(default=False)
 def typing(session):
     """
     Check Bowtie's codebase using pyright.
     """
-    session.install("pyright", f"{ROOT}[strategies]")
+    _install(session, "pyright", f"{ROOT}[strategies]")
     session.run("pyright", BOWTIE)
 
 
@@ -177,31 +322,28 @@ def docs(session, builder):
     """
     Build Bowtie's documentation.
     """
-    session.install("-r", REQUIREMENTS["docs"])
-    with TemporaryDirectory() as tmpdir_str:
-        tmpdir = Path(tmpdir_str)
-        argv = ["-n", "-T", "-W"]
-        if builder != "spelling":
-            argv += ["-q"]
-        posargs = session.posargs or [tmpdir / builder]
-        session.run(
-            "python",
-            "-m",
-            "sphinx",
-            "-b",
-            builder,
-            DOCS,
-            *argv,
-            *posargs,
-        )
+    _install_if_changed(session, REQUIREMENTS["docs"])
+    argv = ["-n", "-T", "-W", "-j", "auto"]
+    if builder != "spelling":
+        argv += ["-q"]
 
+    def sphinx(out):
+        session.run("python", "-m", "sphinx", "-b", builder, DOCS, *argv, *out)
 
-@session(tags=["docs", "style"], name="docs(style)")
+    if session.posargs:
+        sphinx(session.posargs)
+    else:
+        with TemporaryDirectory() as tmpdir:
+            sphinx([Path(tmpdir) / builder])
+
+
+@session(default=False, tags=["docs", "style"], name="docs(style)")
 def docs_style(session):
     """
     Check Bowtie's documentation style.
     """
-    session.install(
+    _install(
+        session,
         "doc8",
         "pygments",
         "pygments-github-lexers",
@@ -209,6 +351,15 @@ def docs_style(session):
     session.run("python", "-m", "doc8", "--config", PYPROJECT, DOCS)
 
 
+@cache
+def _implementations():
+    """
+    The names of each of Bowtie's implementation harnesses, comma-joined.
+    """
+    with os.scandir(IMPLEMENTATIONS) as entries:
+        return ",".join(sorted(e.name for e in entries if e.is_dir()))
+
+
 def benchmark(fn):
     """
     A non-default noxenv to run a specific benchmark.
@@ -218,8 +369,11 @@ def benchmark(fn):
     @session(default=False, tags=["perf"], name=f"bench({name})")
     @wraps(fn)
     def _benchmark(session):
-        session.install("-r", REQUIREMENTS["main"], ROOT)
+        _install(session, "-r", REQUIREMENTS["main"], ROOT)
         bowtie = Path(session.bin) / "bowtie"
+        # Warm the OS and import caches once, so that hyperfine's measured
+        # runs don't include one-time cold-start cost.
+        session.run(str(bowtie), "--help", silent=True)
         hyperfine_args, command = fn(session=session, bowtie=bowtie)
         session.run("hyperfine", *hyperfine_args, command, external=True)
 
@@ -239,7 +393,7 @@ def bench_info(session, bowtie):
             "3",
             "-L",
             "implementation",
-            ",".join(p.name for p in IMPLEMENTATIONS.iterdir() if p.is_dir()),
+            _implementations(),
         ]
     return args, f"{bowtie} info -i {{implementation}}"
 
@@ -257,7 +411,7 @@ def bench_smoke(session, bowtie):
             "3",
             "-L",
             "implementation",
-            ",".join(p.name for p in IMPLEMENTATIONS.iterdir() if p.is_dir()),
+            _implementations(),
         ]
     return args, f"{bowtie} smoke -i {{implementation}}"
 
@@ -279,7 +433,7 @@ def bench_suite(session, bowtie):
             "--ignore-failure",
             "-L",
             "implementation",
-            ",".join(p.name for p in IMPLEMENTATIONS.iterdir() if p.is_dir()),
+            _implementations(),
         ]
         command = f"{bowtie} suite -i {{implementation}} {posargs}"
     else:
@@ -287,6 +441,24 @@ def bench_suite(session, bowtie):
     return args, command
 
 
+@session(default=False, tags=["perf"], name="bench(tests)")
+def bench_tests(session):
+    """
+    Run Bowtie's in-process benchmarks via pytest-benchmark.
+
+    Unlike the hyperfine benchmarks, these time the measured code itself
+    rather than including a process spawn per iteration, so they're the
+    right tool for anything which isn't a startup benchmark.
+    """
+    _install_if_changed(session, REQUIREMENTS["tests"])
+    session.run(
+        "pytest",
+        "--benchmark-only",
+        *session.posargs,
+        TESTS / "bench",
+    )
+
+
 @session(default=False, python=False)
 def develop_harness(session):
     """
@@ -298,34 +470,82 @@ def develop_harness(session):
 
     For "real" versions of harnesses, rely on the built version from GitHub
     packages.
+
+    Pass ``--parallel`` to build multiple harnesses concurrently.
     """
-    for each in session.posargs:
-        name = Path(each).name
-        session.run(
-            "podman",
-            "build",
-            "-f",
-            IMPLEMENTATIONS / name / "Dockerfile",
-            "-t",
-            f"ghcr.io/bowtie-json-schema/{name}",
-            external=True,
-        )
+    posargs = [arg for arg in session.posargs if arg != "--parallel"]
+    names = [Path(each).name for each in posargs]
+
+    if len(posargs) != len(session.posargs) and len(names) > 1:
+        # session.run isn't thread-safe, so drive podman directly.
+        def build(name):
+            argv = [
+                "podman",
+                "build",
+                "-f",
+                str(IMPLEMENTATIONS / name / "Dockerfile"),
+                "-t",
+                f"ghcr.io/bowtie-json-schema/{name}",
+            ]
+            try:
+                process = subprocess.run(argv, check=False)  # noqa: S603
+            except OSError as error:
+                session.log(f"Failed to run podman for {name}: {error}")
+                return 1
+            return process.returncode
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            codes = executor.map(build, names)
+            failed = [name for name, code in zip(names, codes) if code]
+        if failed:
+            session.error(f"Failed to build: {', '.join(failed)}")
+    else:
+        for name in names:
+            session.run(
+                "podman",
+                "build",
+                "-f",
+                IMPLEMENTATIONS / name / "Dockerfile",
+                "-t",
+                f"ghcr.io/bowtie-json-schema/{name}",
+                external=True,
+            )
+
+    for name in names:
         session.run("bowtie", "smoke", "--quiet", "-i", name, external=True)
 
 
+@session(default=False)
+def prime_wheels(session):
+    """
+    Prime the local wheelhouse which speeds up repeated installs.
+    """
+    WHEELHOUSE.mkdir(parents=True, exist_ok=True)
+    session.run(
+        "python",
+        "-m",
+        "pip",
+        "wheel",
+        "-w",
+        WHEELHOUSE,
+        *(arg for path in REQUIREMENTS.values() for arg in ("-r", str(path))),
+    )
+
+
 @session(default=False)
 def requirements(session):
     """
     Update bowtie's requirements.txt files.
     """
-    session.install("pip-tools")
-    for each in REQUIREMENTS_IN:
+    _install(session, "uv")
+    for each, out in zip(_requirements_in(), REQUIREMENTS.values()):
         session.run(
-            "pip-compile",
-            "--resolver",
-            "backtracking",
-            "--strip-extras",
-            "-U",
+            "uv",
+            "pip",
+            "compile",
+            "--upgrade",
+            "-o",
+            out.relative_to(ROOT),
             each.relative_to(ROOT),
         )
 
@@ -0,0 +1,60 @@
+"""
+In-process benchmarks for Bowtie's report handling.
+
+These run via ``pytest-benchmark`` (see the ``bench(tests)`` nox session),
+which times the code itself rather than mostly interpreter startup the way
+a subprocess-spawning harness would.
+"""
+import json
+
+from bowtie._cli import DRAFT2020
+from bowtie._report import Report, RunMetadata
+
+IMPLEMENTATIONS = {
+    f"bowtie-implementation-{n}": {"image": f"bowtie-implementation-{n}"}
+    for n in range(3)
+}
+
+
+def _serialized(cases=100):
+    metadata = RunMetadata(dialect=DRAFT2020, implementations=IMPLEMENTATIONS)
+    lines = [metadata.serializable()]
+    for seq in range(1, cases + 1):
+        lines.append(
+            dict(
+                seq=seq,
+                case=dict(
+                    description=f"case {seq}",
+                    schema={"type": "integer"},
+                    tests=[
+                        dict(description="valid", instance=37, valid=True),
+                        dict(
+                            description="invalid",
+                            instance="foo",
+                            valid=False,
+                        ),
+                    ],
+                ),
+            ),
+        )
+        lines.extend(
+            dict(
+                implementation=implementation,
+                seq=seq,
+                results=[dict(valid=True), dict(valid=False)],
+                expected=[True, False],
+            )
+            for implementation in IMPLEMENTATIONS
+        )
+    lines.append(dict(did_fail_fast=False))
+    return [json.dumps(line) for line in lines]
+
+
+def test_from_serialized(benchmark):
+    serialized = _serialized()
+    report = benchmark(Report.from_serialized, serialized)
+    assert not report.is_empty
+
+
+def test_empty(benchmark):
+    assert benchmark(Report.empty, dialect=DRAFT2020).is_empty